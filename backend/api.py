@@ -1,17 +1,42 @@
+# Pick the Socket.IO async backend before any other import: eventlet and
+# gevent must monkey-patch the standard library to serve real WebSockets
 import os
+async_mode = os.getenv("SOCKETIO_ASYNC_MODE")
+if async_mode in (None, 'eventlet'):
+    try:
+        import eventlet
+        eventlet.monkey_patch()
+        async_mode = 'eventlet'
+    except ImportError:
+        async_mode = None
+if async_mode in (None, 'gevent'):
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+        async_mode = 'gevent'
+    except ImportError:
+        async_mode = None
+if async_mode is None:
+    # Threading mode is always available but falls back to long-polling
+    # unless the server supports WebSockets natively
+    async_mode = 'threading'
+
 import io
-import tempfile
+import sys
+import atexit
+import logging
+import logging.handlers
 import json
-import traceback
 import time
 import uuid
+import queue
+from collections import deque
 import numpy as np
 import threading
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file, Response, stream_with_context
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, disconnect
-from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 from audio_analysis_service import audio_analysis_service
 from socket_vad_service import socket_vad_service
@@ -20,52 +45,113 @@ from socket_vad_service import socket_vad_service
 load_dotenv()
 
 # Try to get OpenAI API key
+openai_client = None
 try:
     import openai
     openai_api_key = os.getenv("OPENAI_API_KEY") or os.getenv("VITE_OPENAI_API_KEY")
     if openai_api_key:
         openai.api_key = openai_api_key
+        # One client for the whole process so its connection pool keeps
+        # TLS connections to the API alive between requests
+        openai_client = openai.OpenAI(api_key=openai_api_key, timeout=60.0)
         print(f"✅ Found OpenAI API key: {openai_api_key[:5]}...{openai_api_key[-5:]}")
     else:
         print("⚠️ WARNING: OpenAI API key not found in environment variables")
 except ImportError:
     print("⚠️ OpenAI package not installed, AI features will be unavailable")
 
+# Whether the AI endpoints can call OpenAI, decided once at startup
+OPENAI_AVAILABLE = openai_client is not None
+
 # Initialize Flask app
 app = Flask(__name__)
 
+# Use orjson for request parsing, JSON responses and Socket.IO packets when available
+try:
+    import orjson
+    from flask.json.provider import JSONProvider
+
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    class OrjsonCodec:
+        """json-module compatible codec backed by orjson's C encoder/decoder."""
+
+        @staticmethod
+        def dumps(obj, **kwargs):
+            return orjson.dumps(obj, option=ORJSON_OPTIONS).decode()
+
+        @staticmethod
+        def loads(s, **kwargs):
+            return orjson.loads(s)
+
+    class OrjsonProvider(JSONProvider):
+        """Flask JSON provider backed by orjson."""
+
+        def dumps(self, obj, **kwargs):
+            return OrjsonCodec.dumps(obj)
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(
+                orjson.dumps(obj, option=ORJSON_OPTIONS),
+                mimetype='application/json'
+            )
+
+    app.json = OrjsonProvider(app)
+    socketio_json = OrjsonCodec
+except ImportError:
+    print("⚠️ orjson not installed, falling back to the standard json module")
+    socketio_json = json
+
 # Global configuration
 DEBUG = os.getenv("DEBUG", "true").lower() == "true"
-TEMP_DIR = tempfile.gettempdir()
+TTS_CHUNK_SIZE = 4096  # Bytes per streamed TTS audio chunk
+VAD_WORKERS = int(os.getenv("VAD_WORKERS", max(2, os.cpu_count() or 1)))
+AUDIO_QUEUE_SIZE = 64  # Pending audio chunks per VAD worker before frames are dropped
+VAD_BATCH_INTERVAL = 0.02  # Seconds between vad_update_batch flushes
+SESSION_REAP_INTERVAL = 30  # Seconds between sweeps for idle sessions
+SOCKETIO_SERIALIZER = os.getenv("SOCKETIO_SERIALIZER", "default")
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:5173,http://localhost:3000,http://localhost:5001")
 
 # Enable CORS for development and production
-CORS(app, resources={r"/*": {"origins": CORS_ORIGINS.split(",")}}, supports_credentials=True)
+CORS(
+    app,
+    resources={r"/*": {"origins": CORS_ORIGINS.split(",")}},
+    methods=["GET", "POST", "PUT", "OPTIONS"],
+    supports_credentials=True,
+    max_age=86400  # Let browsers cache preflight results for a day
+)
 
-# Initialize SocketIO with appropriate async mode
-# Python 3.13 has issues with gevent monkey-patching, use threading mode
+# Compress JSON responses for clients that accept it; audio and streamed
+# responses (TTS, mentor chat SSE) are sent as-is
 try:
-    import sys
-    if sys.version_info >= (3, 13):
-        # For Python 3.13+, use threading mode to avoid gevent monkey-patching issues
-        async_mode = 'threading'
-        print(f"🔄 Using threading mode for Python {sys.version}")
-    else:
-        # For older Python versions, prefer eventlet for production, fallback to gevent
-        try:
-            import eventlet
-            async_mode = 'eventlet'
-        except ImportError:
-            try:
-                import gevent
-                async_mode = 'gevent'
-            except ImportError:
-                async_mode = 'threading'
-except Exception as e:
-    # Fallback to threading mode which is always available
-    async_mode = 'threading'
-    print(f"⚠️ Exception setting async mode: {e}, falling back to threading")
-        
+    from flask_compress import Compress
+    app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/plain']
+    app.config['COMPRESS_STREAMS'] = False
+    Compress(app)
+except ImportError:
+    print("⚠️ flask-compress not installed, responses will not be compressed")
+
+# Optional binary Socket.IO wire format; clients must use socket.io-msgpack-parser
+socketio_serializer = 'default'
+if SOCKETIO_SERIALIZER == 'msgpack':
+    try:
+        from socketio.msgpack_packet import MsgPackPacket
+
+        def msgpack_default(obj):
+            """Convert NumPy values in VAD results to native msgpack types."""
+            if isinstance(obj, (np.generic, np.ndarray)):
+                return obj.tolist()
+            raise TypeError(f"Object of type {type(obj).__name__} is not msgpack serializable")
+
+        socketio_serializer = MsgPackPacket.configure(dumps_default=msgpack_default)
+    except ImportError:
+        print("⚠️ msgpack not installed, falling back to JSON Socket.IO packets")
+
+# Initialize SocketIO with the async mode selected at import time
 print(f"🔄 Using SocketIO async mode: {async_mode}")
 
 socketio = SocketIO(
@@ -77,14 +163,36 @@ socketio = SocketIO(
     ping_timeout=60,
     ping_interval=25,
     max_http_buffer_size=1024 * 1024,  # 1MB buffer size
+    json=socketio_json,
+    serializer=socketio_serializer,
     websocket_ping_timeout=55  # Websocket specific ping timeout
 )
 
+# Handlers only enqueue log records; a listener thread does the console I/O
+logger = logging.getLogger('csm')
+logger.setLevel(logging.DEBUG if DEBUG else logging.WARNING)
+logger.propagate = False
+log_queue = queue.Queue()
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(logging.Formatter('[%(asctime)s] %(message)s', '%H:%M:%S'))
+log_listener = logging.handlers.QueueListener(log_queue, console_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 # Helper function for logging
-def log(message):
-    """Log a message to the console with timestamp."""
-    if DEBUG:
-        print(f"[{time.strftime('%H:%M:%S')}] {message}")
+def log(message, *args):
+    """Log a message to the console with timestamp; %-style args are only formatted when DEBUG is on."""
+    logger.debug(message, *args)
+
+def log_exception(message):
+    """Log an error message and the active traceback, formatting it only in debug mode."""
+    logger.debug(message, exc_info=True)
+
+# Helper function for wall-clock timestamps
+def now_ms():
+    """Current epoch time in integer milliseconds, without float math."""
+    return time.time_ns() // 1_000_000
 
 # Socket event handlers
 @socketio.on('connect')
@@ -106,7 +214,7 @@ def handle_debug_connection(data=None):
         
         # Send back server-side information about the connection
         emit('debug_response', {
-            'server_time': int(time.time() * 1000),
+            'server_time': now_ms(),
             'sid': request.sid,
             'origin': request.origin,
             'transport': request.args.get('transport', 'unknown'),
@@ -115,8 +223,7 @@ def handle_debug_connection(data=None):
         })
         
     except Exception as e:
-        log(f"Error in debug endpoint: {str(e)}")
-        log(traceback.format_exc())
+        log_exception(f"Error in debug endpoint: {str(e)}")
         emit('error', {'message': f"Debug error: {str(e)}"})
 
 @socketio.on('disconnect')
@@ -130,18 +237,54 @@ def handle_disconnect():
         socket_vad_service.remove_session(session_id)
         log(f"Removed VAD session: {session_id}")
     
-    # Also check active sessions for this client ID
-    for sid, session in list(active_sessions.items()):
-        if session.get('client_id') == request.sid:
-            del active_sessions[sid]
-            log(f"Removed session {sid} for disconnected client {request.sid}")
+    # Also drop the active sessions owned by this client ID
+    with sessions_lock:
+        client_session_ids = client_sessions.pop(request.sid, ())
+        for sid in client_session_ids:
+            active_sessions.pop(sid, None)
+    
+    with pending_lock:
+        pending_updates.pop(request.sid, None)
+    
+    for sid in client_session_ids:
+        log(f"Removed session {sid} for disconnected client {request.sid}")
 
 # Track active sessions
 active_sessions = {}
 
+# Reverse index of client ID -> session IDs so disconnects don't scan every session
+client_sessions = {}
+sessions_lock = threading.Lock()
+
 # Track conversation history
 conversation_histories = {}
 
+def reap_idle_sessions():
+    """Periodically drop sessions whose client stopped sending audio without disconnecting."""
+    timeout_ms = socket_vad_service.config['session_timeout_ms']
+    while True:
+        socketio.sleep(SESSION_REAP_INTERVAL)
+        cutoff = now_ms() - timeout_ms
+        with sessions_lock:
+            idle_ids = [
+                sid for sid, session in active_sessions.items()
+                if session['last_activity'] < cutoff
+            ]
+            for sid in idle_ids:
+                session = active_sessions.pop(sid)
+                owned = client_sessions.get(session['client_id'])
+                if owned is not None:
+                    owned.discard(sid)
+                    if not owned:
+                        del client_sessions[session['client_id']]
+        
+        for sid in idle_ids:
+            socket_vad_service.remove_session(sid)
+        if idle_ids:
+            log(f"Reaped {len(idle_ids)} idle sessions, {len(active_sessions)} still active")
+
+socketio.start_background_task(reap_idle_sessions)
+
 @socketio.on('init_vad')
 def handle_init_vad(data=None):
     """Initialize a new VAD session or retrieve an existing one."""
@@ -154,11 +297,18 @@ def handle_init_vad(data=None):
         session_id, session = socket_vad_service.get_or_create_session(session_id)
         
         # Store session mapping
-        active_sessions[session_id] = {
-            'client_id': request.sid,
-            'created_at': time.time(),
-            'last_activity': time.time()
-        }
+        now = now_ms()
+        with sessions_lock:
+            previous = active_sessions.get(session_id)
+            if previous and previous['client_id'] != request.sid:
+                client_sessions.get(previous['client_id'], set()).discard(session_id)
+            
+            active_sessions[session_id] = {
+                'client_id': request.sid,
+                'created_at': now,
+                'last_activity': now
+            }
+            client_sessions.setdefault(request.sid, set()).add(session_id)
         
         # Return session info
         emit('vad_initialized', {
@@ -170,8 +320,7 @@ def handle_init_vad(data=None):
         log(f"VAD session initialized: {session_id}")
         
     except Exception as e:
-        log(f"Error initializing VAD: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error initializing VAD: {e}")
         emit('error', {'message': f"Failed to initialize VAD: {str(e)}"})
 
 @socketio.on('process_audio')
@@ -186,14 +335,20 @@ def handle_process_audio(data):
             emit('error', {'message': "Missing session_id"})
             return
             
+        # Read the clock and the client ID once and reuse them for the whole frame
+        now = now_ms()
+        client_sid = request.sid
+        
         # Update session activity time
-        if session_id in active_sessions:
-            active_sessions[session_id]['last_activity'] = time.time()
+        session_info = active_sessions.get(session_id)
+        if session_info:
+            session_info['last_activity'] = now
             
         # If we have a simple audio level, use the legacy approach
         if isinstance(audio_data, (int, float)):
-            result = audio_analysis_service.add_audio_sample(audio_data, int(time.time() * 1000))
-            emit('vad_result', result)
+            result = audio_analysis_service.add_audio_sample(audio_data, now)
+            # Emit on the underlying server to skip flask_socketio.emit's request-context lookups
+            socketio.server.emit('vad_result', result, to=client_sid, namespace=request.namespace)
             return
         
         # Otherwise, use the full socket VAD service
@@ -201,19 +356,164 @@ def handle_process_audio(data):
             emit('error', {'message': "Missing audio data"})
             return
             
-        # Process the audio
-        result = socket_vad_service.process_audio(session_id, audio_data)
+        # Hand the audio to the worker that owns this session
+        try:
+            session_queue(session_id).put_nowait(('audio', session_id, audio_data, client_sid))
+        except queue.Full:
+            emit('vad_overrun', {
+                'session_id': session_id,
+                'timestamp': now
+            })
+            
+    except Exception as e:
+        log_exception(f"Error processing audio: {e}")
+        emit('error', {'message': f"Failed to process audio: {str(e)}"})
+
+# VAD is CPU-bound and never yields, so under eventlet or gevent (where the
+# workers are greenlets) each chunk is handed to a real OS thread instead of
+# blocking the event loop for every client
+if async_mode == 'eventlet':
+    from eventlet import tpool
+    
+    def run_vad(session_id, audio_data):
+        """Run VAD for a chunk in eventlet's OS thread pool."""
+        return tpool.execute(socket_vad_service.process_audio, session_id, audio_data)
+elif async_mode == 'gevent':
+    import gevent
+    
+    vad_threadpool = gevent.get_hub().threadpool
+    vad_threadpool.maxsize = max(vad_threadpool.maxsize, VAD_WORKERS)
+    
+    def run_vad(session_id, audio_data):
+        """Run VAD for a chunk in gevent's OS thread pool."""
+        return vad_threadpool.apply(socket_vad_service.process_audio, (session_id, audio_data))
+else:
+    def run_vad(session_id, audio_data):
+        """Run VAD for a chunk on the calling worker thread."""
+        return socket_vad_service.process_audio(session_id, audio_data)
+
+def process_audio_worker(audio_queue):
+    """Run VAD for queued audio chunks and emit results to their clients."""
+    while True:
+        kind, session_id, payload, client_sid = audio_queue.get()
+        if kind != 'audio':
+            apply_session_control(kind, session_id, payload, client_sid)
+            continue
+        try:
+            result = run_vad(session_id, payload)
+            
+            # Steady-state updates are coalesced into the next vad_update_batch;
+            # speech transitions go out right away, after any updates queued before them
+            if result.get('event') == 'vad_update':
+                with pending_lock:
+                    pending_updates.setdefault(client_sid, deque()).append(result)
+            elif 'event' in result:
+                # Hold the flush lock so a concurrent periodic flush cannot send
+                # older updates after this transition
+                with flush_lock:
+                    flush_pending_updates(client_sid)
+                    socketio.emit(result['event'], result, to=client_sid)
+            else:
+                socketio.emit('vad_result', result, to=client_sid)
+                
+        except Exception as e:
+            log_exception(f"Error processing audio: {e}")
+            socketio.emit('error', {'message': f"Failed to process audio: {str(e)}"}, to=client_sid)
+
+def apply_session_control(kind, session_id, config, client_sid):
+    """Apply a queued config update or recalibration in order with the session's audio."""
+    action = 'update VAD config' if kind == 'config' else 'force recalibration'
+    try:
+        session = socket_vad_service.get_session(session_id)
+        if not session:
+            socketio.emit('error', {'message': f"Session {session_id} not found"}, to=client_sid)
+            return
         
-        # Check for events that should trigger specific responses
-        if 'event' in result:
-            emit(result['event'], result)
+        if kind == 'config':
+            session.update_vad_config(config)
+            socketio.emit('config_updated', {
+                'session_id': session_id,
+                'config': session.config
+            }, to=client_sid)
         else:
+            session.force_recalibration()
+            socketio.emit('recalibration_started', {
+                'session_id': session_id,
+                'timestamp': now_ms()
+            }, to=client_sid)
+            
+    except Exception as e:
+        log_exception(f"Failed to {action}: {e}")
+        socketio.emit('error', {'message': f"Failed to {action}: {str(e)}"}, to=client_sid)
+
+def session_queue(session_id):
+    """Get the worker queue that owns a session's audio and control messages."""
+    return audio_queues[hash(session_id) % len(audio_queues)]
+
+def flush_pending_updates(client_sid):
+    """Send a client's queued VAD updates as a single vad_update_batch; call with flush_lock held."""
+    with pending_lock:
+        updates = pending_updates.pop(client_sid, None)
+    if updates:
+        socketio.emit('vad_update_batch', list(updates), to=client_sid)
+
+def flush_updates_worker():
+    """Flush every client's queued VAD updates once per batch interval."""
+    while True:
+        socketio.sleep(VAD_BATCH_INTERVAL)
+        with flush_lock:
+            with pending_lock:
+                batches = list(pending_updates.items())
+                pending_updates.clear()
+            for client_sid, updates in batches:
+                socketio.emit('vad_update_batch', list(updates), to=client_sid)
+
+# VAD updates waiting for the next batch flush, keyed by client ID
+pending_updates = {}
+pending_lock = threading.Lock()
+# Serializes taking queued updates and emitting them, so a client never receives
+# a vad_update_batch after a speech transition that followed those updates
+flush_lock = threading.Lock()
+socketio.start_background_task(flush_updates_worker)
+
+# Bounded per-worker audio queues; a session always maps to the same worker
+# so its chunks are processed in order and never concurrently
+audio_queues = [
+    socketio.server.eio.create_queue(maxsize=AUDIO_QUEUE_SIZE)
+    for _ in range(VAD_WORKERS)
+]
+for audio_queue in audio_queues:
+    socketio.start_background_task(process_audio_worker, audio_queue)
+
+@socketio.on('process_levels')
+def handle_process_levels(data):
+    """Process a batch of audio levels and report only speech state changes."""
+    try:
+        levels = data.get('levels')
+        if not levels:
+            emit('error', {'message': "Missing levels"})
+            return
+            
+        # Binary attachments carry the levels as little-endian float32
+        if isinstance(levels, (bytes, bytearray)):
+            levels = np.frombuffer(levels, dtype='<f4').tolist()
+            
+        timestamps = data.get('timestamps')
+        if timestamps is None:
+            timestamps = [now_ms()] * len(levels)
+        elif not isinstance(timestamps, list):
+            emit('error', {'message': "timestamps must be a list"})
+            return
+        elif len(timestamps) != len(levels):
+            emit('error', {'message': "levels and timestamps must have the same length"})
+            return
+            
+        for result in audio_analysis_service.add_audio_samples(levels, timestamps, transitions_only=True):
             emit('vad_result', result)
             
     except Exception as e:
-        log(f"Error processing audio: {e}")
-        log(traceback.format_exc())
-        emit('error', {'message': f"Failed to process audio: {str(e)}"})
+        log_exception(f"Error processing levels: {e}")
+        emit('error', {'message': f"Failed to process levels: {str(e)}"})
 
 @socketio.on('force_recalibration')
 def handle_force_recalibration(data):
@@ -234,17 +534,11 @@ def handle_force_recalibration(data):
             emit('error', {'message': f"Session {session_id} not found"})
             return
         
-        # Force recalibration
-        session.force_recalibration()
-        
-        emit('recalibration_started', {
-            'session_id': session_id,
-            'timestamp': int(time.time() * 1000)
-        })
+        # Recalibrate on the session's worker, after the audio queued before this request
+        session_queue(session_id).put(('recalibrate', session_id, None, request.sid))
         
     except Exception as e:
-        log(f"Error forcing recalibration: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error forcing recalibration: {e}")
         emit('error', {'message': f"Failed to force recalibration: {str(e)}"})
 
 @socketio.on('update_vad_config')
@@ -265,17 +559,12 @@ def handle_update_vad_config(data):
             emit('error', {'message': f"Session {session_id} not found"})
             return
         
-        # Update the session config
-        session.update_vad_config(config)
-        
-        emit('config_updated', {
-            'session_id': session_id,
-            'config': session.config
-        })
+        # Apply the config on the session's worker, so chunks queued before the
+        # change are still processed with the old sample rate and frame size
+        session_queue(session_id).put(('config', session_id, config, request.sid))
         
     except Exception as e:
-        log(f"Error updating VAD config: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error updating VAD config: {e}")
         emit('error', {'message': f"Failed to update VAD config: {str(e)}"})
 
 @socketio.on('update_config')
@@ -286,8 +575,7 @@ def handle_update_config(data):
         result = audio_analysis_service.update_config(config)
         emit('config_updated', result)
     except Exception as e:
-        log(f"Error updating config: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error updating config: {e}")
         emit('error', {'message': str(e)})
 
 @socketio.on('get_debug_state')
@@ -315,8 +603,7 @@ def handle_get_debug_state(data):
         emit('debug_state', debug_state)
         
     except Exception as e:
-        log(f"Error getting debug state: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error getting debug state: {e}")
         emit('error', {'message': f"Failed to get debug state: {str(e)}"})
 
 # Serve test HTML page
@@ -326,67 +613,83 @@ def test_page():
     return app.send_static_file('index.html')
 
 # Basic API routes
+# Fields of the root and health responses that never change after startup
+ROOT_INFO = {
+    'status': 'ok',
+    'service': 'CSM Backend API',
+    'environment': os.getenv('FLASK_ENV', 'development'),
+    'debug': DEBUG
+}
+HEALTH_PREFIX = b'{"status":"ok","timestamp":'
+
 @app.route('/', methods=['GET'])
 def root():
     """Root endpoint for health check and version info."""
     return jsonify({
-        'status': 'ok',
-        'timestamp': int(time.time()),
-        'service': 'CSM Backend API',
-        'environment': os.getenv('FLASK_ENV', 'development'),
+        **ROOT_INFO,
+        'timestamp': now_ms() // 1000,
         'socket_io': {
             'engine': socketio.async_mode,
             'active_sessions': len(active_sessions),
             'vad_sessions': socket_vad_service.get_session_count()
-        },
-        'debug': DEBUG
+        }
     })
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
-    return jsonify({'status': 'ok', 'timestamp': int(time.time())})
+    return Response(b'%s%d}' % (HEALTH_PREFIX, now_ms() // 1000), mimetype='application/json')
 
 # AI endpoints (OpenAI integration)
+
+# Mentor catalogue is fixed after startup, so it is serialized once at import
+MENTORS = [
+    {
+        "id": "marcus",
+        "name": "Marcus Aurelius",
+        "style": "calm",
+        "title": "Philosopher and Roman Emperor",
+        "years": "121-180 CE",
+        "image": "./images/marcus.png",
+        "description": "Known for his personal reflections in \"Meditations\", Marcus Aurelius ruled as Roman Emperor while practicing Stoic philosophy.",
+        "voiceId": "0",
+        "voice": os.getenv("TTS_VOICE_MARCUS", "onyx")
+    },
+    {
+        "id": "seneca",
+        "name": "Seneca",
+        "style": "motivational",
+        "title": "Philosopher and Statesman",
+        "years": "4 BCE-65 CE",
+        "image": "./images/seneca.png",
+        "description": "A Roman Stoic philosopher who served as advisor to Emperor Nero and wrote influential letters on ethics and natural philosophy.",
+        "voiceId": "1",
+        "voice": os.getenv("TTS_VOICE_SENECA", "echo")
+    },
+    {
+        "id": "epictetus",
+        "name": "Epictetus",
+        "style": "firm",
+        "title": "Stoic Philosopher and Former Slave",
+        "years": "50-135 CE",
+        "image": "./images/epictetus.png",
+        "description": "Born a slave and later freed, Epictetus taught that philosophy is a way of life, not just an intellectual exercise.",
+        "voiceId": "2",
+        "voice": os.getenv("TTS_VOICE_EPICTETUS", "ash")
+    }
+]
+MENTORS_JSON = app.json.dumps(MENTORS).encode()
+
 @app.route('/api/mentors', methods=['GET'])
 def get_mentors():
     """Get available mentors."""
-    mentors = [
-        {
-            "id": "marcus",
-            "name": "Marcus Aurelius",
-            "style": "calm",
-            "title": "Philosopher and Roman Emperor",
-            "years": "121-180 CE",
-            "image": "./images/marcus.png",
-            "description": "Known for his personal reflections in \"Meditations\", Marcus Aurelius ruled as Roman Emperor while practicing Stoic philosophy.",
-            "voiceId": "0",
-            "voice": os.getenv("TTS_VOICE_MARCUS", "onyx")
-        },
-        {
-            "id": "seneca",
-            "name": "Seneca",
-            "style": "motivational",
-            "title": "Philosopher and Statesman",
-            "years": "4 BCE-65 CE",
-            "image": "./images/seneca.png",
-            "description": "A Roman Stoic philosopher who served as advisor to Emperor Nero and wrote influential letters on ethics and natural philosophy.",
-            "voiceId": "1",
-            "voice": os.getenv("TTS_VOICE_SENECA", "echo")
-        },
-        {
-            "id": "epictetus",
-            "name": "Epictetus",
-            "style": "firm",
-            "title": "Stoic Philosopher and Former Slave",
-            "years": "50-135 CE",
-            "image": "./images/epictetus.png",
-            "description": "Born a slave and later freed, Epictetus taught that philosophy is a way of life, not just an intellectual exercise.",
-            "voiceId": "2",
-            "voice": os.getenv("TTS_VOICE_EPICTETUS", "ash")
-        }
-    ]
-    return jsonify(mentors)
+    return Response(MENTORS_JSON, mimetype='application/json')
+
+# Constant framing of the mentor chat SSE events, so each token only needs
+# its content JSON-escaped
+SSE_CONTENT_PREFIX = b'data: {"content":'
+SSE_EVENT_SUFFIX = b'}\n\n'
+SSE_DONE = b'data: {"done":true}\n\n'
 
 @app.route('/api/mentor-chat', methods=['POST'])
 def mentor_chat():
@@ -408,28 +711,20 @@ def mentor_chat():
             return jsonify({'error': 'No messages provided'}), 400
             
         # Check if OpenAI is available
-        if 'openai' not in globals() or not openai.api_key:
+        if not OPENAI_AVAILABLE:
             return jsonify({'error': 'OpenAI API not configured'}), 500
             
         # Log the request
         log(f"Mentor chat request: {len(messages)} messages, model={model}, temp={temperature}, stream={stream}")
         
-        # Update conversation history
-        if conversation_id not in conversation_histories:
-            conversation_histories[conversation_id] = []
-            
-        # Add new messages to history
-        conversation_histories[conversation_id].extend(messages)
-        
-        # Trim history if it gets too long (keep last 20 messages)
-        if len(conversation_histories[conversation_id]) > 20:
-            conversation_histories[conversation_id] = conversation_histories[conversation_id][-20:]
+        # Add new messages to history; the deque keeps only the last 20 messages
+        conversation_histories.setdefault(conversation_id, deque(maxlen=20)).extend(messages)
             
         # If streaming is requested, use SSE for streaming response
         if stream:
             def generate():
                 try:
-                    response = openai.chat.completions.create(
+                    response = openai_client.chat.completions.create(
                         model=model,
                         messages=messages,
                         temperature=temperature,
@@ -440,18 +735,18 @@ def mentor_chat():
                     for chunk in response:
                         content = chunk.choices[0].delta.content
                         if content:
-                            yield f"data: {json.dumps({'content': content})}\n\n"
+                            yield SSE_CONTENT_PREFIX + app.json.dumps(content).encode() + SSE_EVENT_SUFFIX
                             
-                    yield f"data: {json.dumps({'done': True})}\n\n"
+                    yield SSE_DONE
                     
                 except Exception as e:
                     log(f"Error in streaming mentor chat: {e}")
-                    yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                    yield f"data: {app.json.dumps({'error': str(e)})}\n\n"
                     
             return Response(stream_with_context(generate()), content_type='text/event-stream')
             
         # For non-streaming responses, return the complete response
-        response = openai.chat.completions.create(
+        response = openai_client.chat.completions.create(
             model=model,
             messages=messages,
             temperature=temperature,
@@ -473,8 +768,7 @@ def mentor_chat():
         })
         
     except Exception as e:
-        log(f"Error in mentor chat: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error in mentor chat: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/tts', methods=['POST'])
@@ -492,39 +786,39 @@ def text_to_speech():
             return jsonify({'error': 'No text provided'}), 400
             
         # Check if OpenAI is available
-        if 'openai' not in globals() or not openai.api_key:
+        if not OPENAI_AVAILABLE:
             return jsonify({'error': 'OpenAI API not configured'}), 500
             
         log(f"TTS request: '{text[:30]}...' with voice {voice}")
         
-        # Generate speech using OpenAI
-        response = openai.audio.speech.create(
-            model="tts-1",
-            voice=voice,
-            input=text,
-            speed=data.get('speed', 1.0)
-        )
-        
-        # Save audio to temporary file
-        temp_file = f"tts_{str(uuid.uuid4())}.mp3"
-        temp_path = os.path.join(TEMP_DIR, temp_file)
-        
-        with open(temp_path, 'wb') as f:
-            response.stream_to_file(temp_path)
-            
-        log(f"TTS audio generated: {temp_path}")
-        
-        # Send the file
-        return send_file(
-            temp_path,
+        # Generate speech using OpenAI, relaying audio chunks as they arrive
+        def generate():
+            with openai_client.audio.speech.with_streaming_response.create(
+                model="tts-1",
+                voice=voice,
+                input=text,
+                speed=data.get('speed', 1.0)
+            ) as response:
+                yield from response.iter_bytes(chunk_size=TTS_CHUNK_SIZE)
+
+        audio_chunks = generate()
+
+        # Pull the first chunk eagerly so API errors still return a JSON 500
+        first_chunk = next(audio_chunks, b'')
+        log(f"TTS audio streaming started ({len(first_chunk)} bytes in first chunk)")
+
+        def stream():
+            yield first_chunk
+            yield from audio_chunks
+
+        return Response(
+            stream(),
             mimetype='audio/mpeg',
-            as_attachment=True,
-            download_name='speech.mp3'
+            headers={'Content-Disposition': 'attachment; filename=speech.mp3'}
         )
             
     except Exception as e:
-        log(f"Error in TTS: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error in TTS: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/transcribe', methods=['POST'])
@@ -534,8 +828,8 @@ def transcribe():
         log("Transcribe endpoint called")
         
         # Debug request details
-        log(f"Request files: {list(request.files.keys())}")
-        log(f"Request headers: {dict(request.headers)}")
+        log("Request files: %s", list(request.files))
+        log("Request headers: %r", request.headers)
         
         # Check if file was uploaded
         if 'audio' not in request.files and 'file' not in request.files:
@@ -548,50 +842,40 @@ def transcribe():
             log("Error: File object is None")
             return jsonify({'error': 'File object is None'}), 400
             
-        filename = secure_filename(file.filename)
+        # The filename is only used by Whisper to infer the audio format
+        filename = file.filename or 'audio.wav'
         log(f"Processing file: {filename}")
-        
+
         # Check if OpenAI is available
-        if 'openai' not in globals() or not openai.api_key:
+        if not OPENAI_AVAILABLE:
             log("Error: OpenAI API not configured")
             return jsonify({'error': 'OpenAI API not configured'}), 500
-            
-        # Save file to temporary directory
-        temp_path = os.path.join(TEMP_DIR, f"transcribe_{filename}")
-        file.save(temp_path)
-        
-        log(f"Transcribing audio: {temp_path}, file size: {os.path.getsize(temp_path)} bytes")
-        
+
+        # Read the upload into memory and pass the bytes straight to the API
+        audio_bytes = file.stream.read()
+
+        log(f"Transcribing audio: {filename}, file size: {len(audio_bytes)} bytes")
+
         # Transcribe the audio
         try:
-            with open(temp_path, "rb") as audio_file:
-                transcript = openai.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language=request.form.get('language', None),
-                    prompt=request.form.get('prompt', None)
-                )
-                
+            transcript = openai_client.audio.transcriptions.create(
+                model="whisper-1",
+                file=(filename, audio_bytes),
+                language=request.form.get('language', None),
+                prompt=request.form.get('prompt', None)
+            )
+
             log(f"Transcription result: {transcript.text[:100]}...")
         except Exception as e:
-            log(f"OpenAI transcription error: {str(e)}")
-            log(traceback.format_exc())
+            log_exception(f"OpenAI transcription error: {str(e)}")
             return jsonify({'error': f"OpenAI transcription error: {str(e)}"}), 500
-        
-        # Clean up
-        try:
-            os.remove(temp_path)
-            log(f"Cleaned up temporary file: {temp_path}")
-        except Exception as cleanup_error:
-            log(f"Warning: Could not clean up temp file: {str(cleanup_error)}")
-            
+
         return jsonify({
             'text': transcript.text
         })
             
     except Exception as e:
-        log(f"Error in transcription: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error in transcription: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/gpt', methods=['POST'])
@@ -608,7 +892,7 @@ def gpt():
         max_tokens = data.get('max_tokens', 1000)
         
         # Check if OpenAI is available
-        if 'openai' not in globals() or not openai.api_key:
+        if not OPENAI_AVAILABLE:
             return jsonify({'error': 'OpenAI API not configured'}), 500
             
         # Check if messages is empty or not provided
@@ -623,7 +907,7 @@ def gpt():
         log(f"GPT request: {len(messages)} messages, model={model}, temp={temperature}")
         
         # Generate response
-        response = openai.chat.completions.create(
+        response = openai_client.chat.completions.create(
             model=model,
             messages=messages,
             temperature=temperature,
@@ -638,19 +922,11 @@ def gpt():
         })
         
     except Exception as e:
-        log(f"Error in GPT: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error in GPT: {e}")
         return jsonify({'error': str(e)}), 500
 
 # Audio analysis endpoints - legacy support
-@app.route('/api/audio-analysis', methods=['OPTIONS'])
-def audio_analysis_options():
-    """Handle OPTIONS request for audio analysis endpoint."""
-    response = jsonify({'status': 'ok'})
-    response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-    return response
-
+# CORS preflight (OPTIONS) requests are answered by flask-cors for every route
 @app.route('/api/audio-analysis', methods=['POST'])
 def audio_analysis():
     """Process audio level data for VAD."""
@@ -660,23 +936,48 @@ def audio_analysis():
             return jsonify({'error': 'Missing level parameter'}), 400
             
         level = float(data['level'])
-        timestamp = data.get('timestamp', int(time.time() * 1000))
+        timestamp = data.get('timestamp')
+        if timestamp is None:
+            timestamp = now_ms()
         
-        result = audio_analysis_service.add_audio_sample(level, timestamp)
+        include_profile = request.args.get('profile') == '1'
+        result = audio_analysis_service.add_audio_sample(level, timestamp, include_profile)
         return jsonify(result)
         
     except Exception as e:
-        log(f"Error in audio analysis: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error in audio analysis: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/audio-analysis/calibrate', methods=['OPTIONS'])
-def audio_analysis_calibrate_options():
-    """Handle OPTIONS request for calibration endpoint."""
-    response = jsonify({'status': 'ok'})
-    response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-    return response
+@app.route('/api/audio-analysis/batch', methods=['POST'])
+def audio_analysis_batch():
+    """Process a batch of audio levels for VAD in one request."""
+    try:
+        data = request.json
+        if not isinstance(data, dict) or not isinstance(data.get('levels'), list):
+            return jsonify({'error': 'Missing levels parameter'}), 400
+            
+        try:
+            levels = [float(level) for level in data['levels']]
+        except (ValueError, TypeError):
+            return jsonify({'error': 'levels must be numbers'}), 400
+        timestamps = data.get('timestamps')
+        if timestamps is None:
+            timestamps = [now_ms()] * len(levels)
+        elif not isinstance(timestamps, list):
+            return jsonify({'error': 'timestamps must be a list'}), 400
+        elif len(timestamps) != len(levels):
+            return jsonify({'error': 'levels and timestamps must have the same length'}), 400
+        
+        results = audio_analysis_service.add_audio_samples(
+            levels, timestamps,
+            transitions_only=bool(data.get('transitions_only')),
+            include_profile=request.args.get('profile') == '1'
+        )
+        return jsonify({'results': results})
+        
+    except Exception as e:
+        log_exception(f"Error in audio analysis batch: {e}")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/audio-analysis/calibrate', methods=['POST'])
 def force_calibration():
@@ -685,22 +986,13 @@ def force_calibration():
         audio_analysis_service.force_recalibration()
         return jsonify({
             'status': 'calibration_started',
-            'timestamp': int(time.time() * 1000)
+            'timestamp': now_ms()
         })
         
     except Exception as e:
-        log(f"Error in force calibration: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error in force calibration: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/audio-analysis/threshold', methods=['OPTIONS'])
-def audio_analysis_threshold_options():
-    """Handle OPTIONS request for threshold endpoint."""
-    response = jsonify({'status': 'ok'})
-    response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-    return response
-
 @app.route('/api/audio-analysis/threshold', methods=['GET'])
 def get_threshold():
     """Get the current threshold value."""
@@ -709,18 +1001,9 @@ def get_threshold():
         return jsonify(profile)
         
     except Exception as e:
-        log(f"Error getting threshold: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error getting threshold: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/audio-analysis/config', methods=['OPTIONS'])
-def audio_analysis_config_options():
-    """Handle OPTIONS request for config endpoint."""
-    response = jsonify({'status': 'ok'})
-    response.headers.add('Access-Control-Allow-Methods', 'POST, PUT, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-    return response
-
 @app.route('/api/audio-analysis/config', methods=['POST', 'PUT'])
 def update_config():
     """Update the audio analysis service configuration."""
@@ -733,18 +1016,9 @@ def update_config():
         return jsonify(audio_analysis_service.get_noise_profile())
         
     except Exception as e:
-        log(f"Error updating config: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error updating config: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/audio-analysis/debug', methods=['OPTIONS'])
-def audio_analysis_debug_options():
-    """Handle OPTIONS request for debug endpoint."""
-    response = jsonify({'status': 'ok'})
-    response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-    return response
-
 @app.route('/api/audio-analysis/debug', methods=['GET'])
 def get_debug_state():
     """Get debug state for the audio analysis service."""
@@ -756,18 +1030,9 @@ def get_debug_state():
         return jsonify(debug_state)
         
     except Exception as e:
-        log(f"Error getting debug state: {e}")
-        log(traceback.format_exc())
+        log_exception(f"Error getting debug state: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/socket.io/', methods=['OPTIONS'])
-def handle_socket_io_options():
-    """Handle OPTIONS request for Socket.IO endpoint."""
-    response = jsonify({'status': 'ok'})
-    response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-    return response
-
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     host = os.environ.get('HOST', '0.0.0.0')
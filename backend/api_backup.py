@@ -1,22 +1,22 @@
+@app.after_request
+def add_cors_headers(response):
+    """Stamp the CORS headers on every response, including error responses."""
+    response.headers['Access-Control-Allow-Origin'] = 'http://localhost:5173'
+    response.headers['Access-Control-Allow-Credentials'] = 'true'
+    response.headers.setdefault('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.setdefault('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    response.headers.setdefault('Access-Control-Max-Age', '86400')
+    return response
+
 @app.route('/api/audio-analysis', methods=['OPTIONS'])
 def audio_analysis_options():
     """Handle CORS preflight requests for audio-analysis endpoint."""
-    response = jsonify({"status": "ok"})
-    response.headers.add('Access-Control-Allow-Origin', 'http://localhost:5173')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-    response.headers.add('Access-Control-Allow-Methods', 'POST,OPTIONS')
-    response.headers.add('Access-Control-Allow-Credentials', 'true')
-    return response
+    return Response(status=204)
 
 @app.route('/api/audio-analysis/calibrate', methods=['OPTIONS'])
 def audio_analysis_calibrate_options():
     """Handle CORS preflight requests for audio-analysis/calibrate endpoint."""
-    response = jsonify({"status": "ok"})
-    response.headers.add('Access-Control-Allow-Origin', 'http://localhost:5173')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-    response.headers.add('Access-Control-Allow-Methods', 'POST,OPTIONS')
-    response.headers.add('Access-Control-Allow-Credentials', 'true')
-    return response
+    return Response(status=204)
 
 @app.route('/api/audio-analysis', methods=['POST'])
 def audio_analysis():
@@ -25,46 +25,24 @@ def audio_analysis():
         data = request.json
         if not data or 'level' not in data:
             return jsonify({"error": "Missing 'level' in request"}), 400
-        
+
         # Process the audio sample
         timestamp = data.get('timestamp')
         result = audio_analysis_service.add_audio_sample(data['level'], timestamp)
-        
-        # Add CORS headers to the response
-        response = jsonify(result)
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:5173')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
-        
+        return jsonify(result)
+
     except Exception as e:
         print(f"Error in audio analysis: {e}")
         print(traceback.format_exc())
-        response = jsonify({"error": str(e)}), 500
-        response[0].headers.add('Access-Control-Allow-Origin', 'http://localhost:5173')
-        response[0].headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-        response[0].headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-        response[0].headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/api/audio-analysis/calibrate', methods=['POST'])
 def force_calibration():
     """Force recalibration of the audio analysis service."""
     try:
         audio_analysis_service.force_recalibration()
-        response = jsonify({"status": "success", "message": "Recalibration started"})
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:5173')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
+        return jsonify({"status": "success", "message": "Recalibration started"})
     except Exception as e:
         print(f"Error in force calibration: {e}")
         print(traceback.format_exc())
-        response = jsonify({"error": str(e)}), 500
-        response[0].headers.add('Access-Control-Allow-Origin', 'http://localhost:5173')
-        response[0].headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-        response[0].headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-        response[0].headers.add('Access-Control-Allow-Credentials', 'true')
-        return response 
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
@@ -8,17 +8,30 @@ background noise levels.
 
 import time
 import math
-import statistics
+import numpy as np
+from collections import deque
+from enum import IntEnum
+from itertools import islice
 from typing import Dict, List, Optional, Callable, Union, Any, Tuple
 
 # Define event types
-class AudioAnalysisEvent:
+class AudioAnalysisEvent(IntEnum):
     """Event types that can be emitted by the AudioAnalysisService."""
-    CALIBRATION_START = 'calibration-start'
-    CALIBRATION_COMPLETE = 'calibration-complete'
-    SPEECH_START = 'speech-start'
-    SPEECH_END = 'speech-end'
-    THRESHOLD_CHANGED = 'threshold-changed'
+    CALIBRATION_START = 0
+    CALIBRATION_COMPLETE = 1
+    SPEECH_START = 2
+    SPEECH_END = 3
+    THRESHOLD_CHANGED = 4
+
+# Public event names, indexed by AudioAnalysisEvent; listeners receive these names
+EVENT_NAMES = (
+    'calibration-start',
+    'calibration-complete',
+    'speech-start',
+    'speech-end',
+    'threshold-changed'
+)
+_EVENTS_BY_NAME = {name: AudioAnalysisEvent(index) for index, name in enumerate(EVENT_NAMES)}
 
 # Default configuration
 DEFAULT_CONFIG = {
@@ -32,12 +45,29 @@ DEFAULT_CONFIG = {
     'debug': False
 }
 
+# Sensitivity factor adaptation after recalibration
+STABLE_STD_DEV = 0.01  # Below this the background is stable, so sensitivity is reduced
+NOISY_STD_DEV = 0.1  # Above this the background is variable, so sensitivity is increased
+MIN_SENSITIVITY_FACTOR = 1.2
+MAX_SENSITIVITY_FACTOR = 2.5
+SENSITIVITY_STEP_UP = 1.1
+SENSITIVITY_STEP_DOWN = 0.9
+
 class AudioAnalysisService:
     """
     A standalone service for audio level analysis and speech detection
     with adaptive thresholding.
     """
-    
+
+    # Fixed attribute layout; state is read and written on every sample
+    __slots__ = (
+        '_config', '_samples', '_noise_floor', '_std_dev', '_sensitivity_factor',
+        '_threshold', '_profile', '_last_calibration_time', '_calibration_complete',
+        '_is_calibrating', '_calibration_count', '_calibration_mean', '_calibration_m2',
+        '_last_is_speech', '_consecutive_speech_frames', '_consecutive_silence_frames',
+        '_last_speech_time', '_last_silence_time', '_event_listeners'
+    )
+
     def __init__(self, config: Optional[Dict[str, Any]] = None):
         """
         Initialize the AudioAnalysisService with optional configuration.
@@ -51,7 +81,7 @@ class AudioAnalysisService:
             self._config.update(config)
         
         # Internal state
-        self._samples = []
+        self._samples = deque()
         self._noise_floor = 0.0
         self._std_dev = 0.0
         self._sensitivity_factor = self._config['initial_sensitivity_factor']
@@ -64,14 +94,8 @@ class AudioAnalysisService:
         self._last_speech_time = 0
         self._last_silence_time = 0
         
-        # Event system
-        self._event_listeners = {
-            AudioAnalysisEvent.CALIBRATION_START: [],
-            AudioAnalysisEvent.CALIBRATION_COMPLETE: [],
-            AudioAnalysisEvent.SPEECH_START: [],
-            AudioAnalysisEvent.SPEECH_END: [],
-            AudioAnalysisEvent.THRESHOLD_CHANGED: []
-        }
+        # Event system; one immutable tuple of listeners per event, indexed by AudioAnalysisEvent
+        self._event_listeners = [() for _ in AudioAnalysisEvent]
         
         # Start initial calibration
         self._start_calibration()
@@ -80,8 +104,14 @@ class AudioAnalysisService:
         """Start the calibration process."""
         self._is_calibrating = True
         self._calibration_complete = False
-        self._samples = []
-        self._last_calibration_time = int(time.time() * 1000)  # Current time in ms
+        self._samples = deque()  # Unbounded so calibration sees every sample
+        
+        # Running (Welford) count, mean and sum of squared deviations of the calibration samples
+        self._calibration_count = 0
+        self._calibration_mean = 0.0
+        self._calibration_m2 = 0.0
+        self._last_calibration_time = time.time_ns() // 1_000_000  # Current time in ms
+        self._refresh_profile()
         
         self._emit_event(AudioAnalysisEvent.CALIBRATION_START)
         
@@ -90,9 +120,9 @@ class AudioAnalysisService:
     
     def _complete_calibration(self) -> None:
         """Complete the calibration process using collected samples."""
-        if len(self._samples) >= 5:
-            self._noise_floor = statistics.mean(self._samples)
-            self._std_dev = statistics.stdev(self._samples) if len(self._samples) > 1 else 0.01
+        if self._calibration_count >= 5:
+            self._noise_floor = self._calibration_mean
+            self._std_dev = math.sqrt(self._calibration_m2 / (self._calibration_count - 1))
         else:
             # Not enough samples, use default values
             self._noise_floor = 0.02
@@ -101,6 +131,10 @@ class AudioAnalysisService:
         self._is_calibrating = False
         self._calibration_complete = True
         
+        # From here on only the most recent samples are kept
+        self._samples = deque(self._samples, maxlen=self._config['max_sample_history'])
+        self._refresh_profile()
+        
         if self._config['debug']:
             print(f"[AudioAnalysisService] Calibration complete:")
             print(f"  Noise floor: {self._noise_floor:.4f}")
@@ -112,25 +146,33 @@ class AudioAnalysisService:
             self.get_noise_profile()
         )
     
-    def add_audio_sample(self, level: float, timestamp: Optional[int] = None) -> Dict[str, Any]:
+    def add_audio_sample(self, level: float, timestamp: Optional[int] = None,
+                         include_profile: bool = False) -> Dict[str, Any]:
         """
         Add a new audio level sample for analysis.
         
         Args:
             level: Audio level (0-1 range)
             timestamp: Optional timestamp in ms (defaults to current time)
+            include_profile: Attach the noise profile even when the speech state did not change
             
         Returns:
             Analysis result
         """
         # Use current time if timestamp not provided
         if timestamp is None:
-            timestamp = int(time.time() * 1000)
+            timestamp = time.time_ns() // 1_000_000
         
         # During calibration phase, collect samples
         if self._is_calibrating:
             self._samples.append(level)
             
+            # Update the calibration statistics incrementally
+            self._calibration_count += 1
+            delta = level - self._calibration_mean
+            self._calibration_mean += delta / self._calibration_count
+            self._calibration_m2 += delta * (level - self._calibration_mean)
+            
             # Check if calibration duration has elapsed
             elapsed = timestamp - self._last_calibration_time
             if elapsed >= self._config['calibration_duration_ms']:
@@ -141,14 +183,12 @@ class AudioAnalysisService:
                 'level': level,
                 'threshold': 0,
                 'is_speech': False,
-                'profile': self.get_noise_profile(),
+                'profile': self.get_noise_profile() if include_profile else None,
                 'timestamp': timestamp
             }
         
-        # Add sample to history
+        # Add sample to history (the deque drops the oldest sample when full)
         self._samples.append(level)
-        if len(self._samples) > self._config['max_sample_history']:
-            self._samples.pop(0)  # Remove oldest sample
         
         # Get current threshold
         threshold = self.get_current_threshold()
@@ -200,34 +240,63 @@ class AudioAnalysisService:
         if not is_speech and \
            silence_duration > self._config['silence_duration_for_recal_ms'] and \
            (timestamp - self._last_calibration_time) > self._config['recalibration_interval_ms']:
-            self._recalibrate_from_recent_silence()
+            self._recalibrate_from_recent_silence(timestamp)
         
         # Return regular update
         return {
             'level': level,
             'threshold': threshold,
             'is_speech': self._last_is_speech,
-            'profile': self.get_noise_profile(),
+            'profile': self.get_noise_profile() if include_profile else None,
             'timestamp': timestamp
         }
     
-    def _recalibrate_from_recent_silence(self) -> None:
-        """Recalibrate using recent silence samples."""
+    def add_audio_samples(self, levels: List[float], timestamps: List[int],
+                          transitions_only: bool = False,
+                          include_profile: bool = False) -> List[Dict[str, Any]]:
+        """
+        Add a batch of audio level samples in order.
+        
+        Args:
+            levels: Audio levels (0-1 range)
+            timestamps: Timestamp in ms of each level
+            transitions_only: Only return the results where the speech state changed
+            include_profile: Attach the noise profile to every result, not just transitions
+            
+        Returns:
+            Analysis results, one per sample unless transitions_only is set
+        """
+        results = []
+        for level, timestamp in zip(levels, timestamps):
+            was_speech = self._last_is_speech
+            result = self.add_audio_sample(level, timestamp, include_profile)
+            # Compare the service state, not the result: calibration results always
+            # report is_speech False without changing the speech state
+            if not transitions_only or self._last_is_speech != was_speech:
+                results.append(result)
+        return results
+    
+    def _recalibrate_from_recent_silence(self, timestamp: int) -> None:
+        """Recalibrate using recent silence samples, as of the sample at `timestamp` (ms)."""
         # Use only the last N silence samples for recalibration
-        silence_samples = self._samples[-min(10, len(self._samples)):]
+        silence_samples = self._recent_samples(10)
         
         # Calculate new noise floor from silent samples
         if silence_samples:
             old_floor = self._noise_floor
             
             # Apply smoothing to avoid abrupt changes
-            new_floor = statistics.mean(silence_samples)
+            count = len(silence_samples)
+            new_floor = sum(silence_samples) / count
             self._noise_floor = (old_floor * (1 - self._config['smoothing_factor']) + 
                                 new_floor * self._config['smoothing_factor'])
             
-            self._std_dev = statistics.stdev(silence_samples) if len(silence_samples) > 1 else self._std_dev
+            if count > 1:
+                squared_deviations = sum((x - new_floor) ** 2 for x in silence_samples)
+                self._std_dev = math.sqrt(squared_deviations / (count - 1))
             
-            self._last_calibration_time = int(time.time() * 1000)
+            self._last_calibration_time = timestamp
+            self._refresh_profile()
             
             if self._config['debug'] and abs(old_floor - self._noise_floor) > 0.005:
                 print(f"[AudioAnalysisService] Recalibrated noise floor: {old_floor:.4f} → {self._noise_floor:.4f}")
@@ -237,16 +306,17 @@ class AudioAnalysisService:
     def _adjust_sensitivity_factor(self) -> None:
         """Dynamically adjust sensitivity factor based on signal conditions."""
         # If std_dev is very low (stable background), reduce sensitivity
-        if self._std_dev < 0.01:
-            new_factor = min(2.5, self._sensitivity_factor * 1.1)
+        if self._std_dev < STABLE_STD_DEV:
+            new_factor = min(MAX_SENSITIVITY_FACTOR, self._sensitivity_factor * SENSITIVITY_STEP_UP)
         # If std_dev is high (variable background), increase sensitivity
-        elif self._std_dev > 0.1:
-            new_factor = max(1.2, self._sensitivity_factor * 0.9)
+        elif self._std_dev > NOISY_STD_DEV:
+            new_factor = max(MIN_SENSITIVITY_FACTOR, self._sensitivity_factor * SENSITIVITY_STEP_DOWN)
         else:
             return
             
         if abs(new_factor - self._sensitivity_factor) > 0.1:
             self._sensitivity_factor = new_factor
+            self._refresh_profile()
             if self._config['debug']:
                 print(f"[AudioAnalysisService] Adjusted sensitivity factor: {self._sensitivity_factor:.2f}")
             
@@ -255,27 +325,39 @@ class AudioAnalysisService:
                 'sensitivity_factor': self._sensitivity_factor
             })
     
+    def _refresh_profile(self) -> None:
+        """Recompute the threshold and the fixed part of the noise profile after a parameter change."""
+        if self._calibration_complete:
+            # Dynamic threshold based on noise floor and standard deviation
+            self._threshold = self._noise_floor + (self._std_dev * self._sensitivity_factor)
+        else:
+            self._threshold = 0.1  # Default threshold during calibration
+        
+        self._profile = {
+            'noise_floor': self._noise_floor,
+            'std_dev': self._std_dev,
+            'sensitivity_factor': self._sensitivity_factor,
+            'threshold': self._threshold,
+            'calibration_complete': self._calibration_complete,
+            'last_calibration_time': self._last_calibration_time
+        }
+    
     def get_current_threshold(self) -> float:
         """Get the current speech detection threshold."""
-        if not self._calibration_complete:
-            return 0.1  # Default threshold during calibration
-        
-        # Dynamic threshold based on noise floor and standard deviation
-        return self._noise_floor + (self._std_dev * self._sensitivity_factor)
+        return self._threshold
     
     def get_noise_profile(self) -> Dict[str, Any]:
         """Get the current noise profile information."""
         return {
-            'noise_floor': self._noise_floor,
-            'std_dev': self._std_dev,
-            'sensitivity_factor': self._sensitivity_factor,
-            'threshold': self.get_current_threshold(),
-            'calibration_complete': self._calibration_complete,
-            'last_calibration_time': self._last_calibration_time,
+            **self._profile,
             'samples_count': len(self._samples),
-            'recent_levels': self._samples[-5:] if len(self._samples) >= 5 else self._samples
+            'recent_levels': self._recent_samples(5)
         }
     
+    def _recent_samples(self, count: int) -> List[float]:
+        """Get up to the last `count` samples, oldest first."""
+        return list(islice(self._samples, max(0, len(self._samples) - count), None))
+    
     def is_speech_detected(self, level: Optional[float] = None) -> bool:
         """
         Check if speech is detected at the given level.
@@ -308,31 +390,45 @@ class AudioAnalysisService:
         # Apply special parameters that need immediate effect
         if 'initial_sensitivity_factor' in config:
             self._sensitivity_factor = config['initial_sensitivity_factor']
+            self._refresh_profile()
+        if 'max_sample_history' in config and not self._is_calibrating:
+            self._samples = deque(self._samples, maxlen=config['max_sample_history'])
     
-    def add_event_listener(self, event: str, callback: Callable) -> None:
+    def add_event_listener(self, event: Union[str, AudioAnalysisEvent], callback: Callable) -> None:
         """Add an event listener for the specified event."""
-        if event in self._event_listeners:
-            self._event_listeners[event].append(callback)
-        else:
-            raise ValueError(f"Unknown event type: {event}")
+        index = self._event_index(event)
+        self._event_listeners[index] += (callback,)
     
-    def remove_event_listener(self, event: str, callback: Callable) -> None:
+    def remove_event_listener(self, event: Union[str, AudioAnalysisEvent], callback: Callable) -> None:
         """Remove an event listener for the specified event."""
-        if event in self._event_listeners:
-            if callback in self._event_listeners[event]:
-                self._event_listeners[event].remove(callback)
-        else:
-            raise ValueError(f"Unknown event type: {event}")
+        index = self._event_index(event)
+        listeners = self._event_listeners[index]
+        if callback in listeners:
+            position = listeners.index(callback)
+            self._event_listeners[index] = listeners[:position] + listeners[position + 1:]
     
-    def _emit_event(self, event: str, data=None) -> None:
+    @staticmethod
+    def _event_index(event: Union[str, AudioAnalysisEvent]) -> AudioAnalysisEvent:
+        """Resolve an event name or AudioAnalysisEvent to its listener index."""
+        if isinstance(event, AudioAnalysisEvent):
+            return event
+        try:
+            return _EVENTS_BY_NAME[event]
+        except (KeyError, TypeError):
+            raise ValueError(f"Unknown event type: {event}") from None
+    
+    def _emit_event(self, event: AudioAnalysisEvent, data=None) -> None:
         """Emit an event to all registered listeners."""
-        if event in self._event_listeners:
-            for callback in self._event_listeners[event]:
-                try:
-                    callback(event, data)
-                except Exception as e:
-                    if self._config['debug']:
-                        print(f"[AudioAnalysisService] Error in event listener: {e}")
+        listeners = self._event_listeners[event]
+        if not listeners:
+            return
+        name = EVENT_NAMES[event]
+        for callback in listeners:
+            try:
+                callback(name, data)
+            except Exception as e:
+                if self._config['debug']:
+                    print(f"[AudioAnalysisService] Error in event listener: {e}")
     
     def get_debug_state(self) -> Optional[Dict[str, Any]]:
         """Get debug state information for troubleshooting."""
@@ -353,14 +449,15 @@ class AudioAnalysisService:
             'last_is_speech': self._last_is_speech,
             'consecutive_speech_frames': self._consecutive_speech_frames,
             'consecutive_silence_frames': self._consecutive_silence_frames,
-            'recent_samples': self._samples[-10:] if len(self._samples) >= 10 else self._samples
+            'recent_samples': self._recent_samples(10)
         }
 
-def calculate_rms(samples: List[float]) -> float:
-    """Calculate Root Mean Square of a list of samples."""
-    if not samples:
+def calculate_rms(samples: Union[List[float], np.ndarray]) -> float:
+    """Calculate Root Mean Square of a list or array of samples."""
+    samples = np.asarray(samples, dtype=np.float64)
+    if samples.size == 0:
         return 0.0
-    return math.sqrt(sum(x * x for x in samples) / len(samples))
+    return float(np.sqrt(np.dot(samples, samples) / samples.size))
 
 # Create a global instance for service-wide use
 audio_analysis_service = AudioAnalysisService() 
\ No newline at end of file
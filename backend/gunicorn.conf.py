@@ -0,0 +1,49 @@
+"""
+Gunicorn configuration for serving the CSM Backend API in production.
+
+Usage:
+    gunicorn -c gunicorn.conf.py api:app
+
+The development server started by `python api.py` is not meant for
+production; in threading mode socketio.run refuses to start without a TTY
+unless allow_unsafe_werkzeug is set. This configuration runs the app under
+a production worker that matches the SocketIO async mode.
+"""
+
+import os
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+
+# Socket.IO keeps session state in process memory, so only a single worker
+# is supported without a message queue and sticky sessions
+workers = 1
+
+def _default_worker_class():
+    """Match the worker to the SocketIO async mode api.py will select."""
+    async_mode = os.getenv('SOCKETIO_ASYNC_MODE')
+    if async_mode in (None, 'eventlet'):
+        try:
+            import eventlet  # noqa: F401
+            return 'eventlet'
+        except ImportError:
+            pass
+    if async_mode in (None, 'gevent'):
+        try:
+            import gevent  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            try:
+                import geventwebsocket  # noqa: F401
+                return 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker'
+            except ImportError:
+                return 'gevent'
+    return 'gthread'
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS') or _default_worker_class()
+
+# Only used by the threaded worker
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+
+# OpenAI requests (chat, TTS, transcription) can take tens of seconds
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
@@ -12,10 +12,37 @@ import time
 import webrtcvad
 import threading
 import uuid
-from typing import Dict, Any, Optional, List, Tuple
+from collections import deque
+from itertools import islice
+from typing import Dict, Any, Optional, Tuple, Union, Deque
 from audio_analysis_service import AudioAnalysisService, AudioAnalysisEvent
 from dataclasses import dataclass
 
+# Optional JIT for the frame RMS kernel; it releases the GIL, so VAD running on
+# separate OS threads (worker threads in threading mode, the eventlet/gevent
+# thread pool otherwise) can compute frame energy in parallel
+try:
+    from numba import njit
+    
+    @njit(nogil=True, cache=True, fastmath=True)
+    def frames_rms(pcm_frames):
+        """Normalized (0-1) RMS level of each row of an int16 PCM frame matrix."""
+        n_frames, frame_samples = pcm_frames.shape
+        levels = np.empty(n_frames)
+        for i in range(n_frames):
+            total = 0.0
+            for j in range(frame_samples):
+                sample = float(pcm_frames[i, j])
+                total += sample * sample
+            levels[i] = np.sqrt(total / max(frame_samples, 1)) / 32768.0
+        return levels
+except ImportError:
+    def frames_rms(pcm_frames):
+        """Normalized (0-1) RMS level of each row of an int16 PCM frame matrix."""
+        # One float32 copy; einsum squares and sums each row without a squared temporary
+        samples = pcm_frames.astype(np.float32)
+        return np.sqrt(np.einsum('ij,ij->i', samples, samples) / pcm_frames.shape[1]) / 32768.0
+
 # Default configuration
 DEFAULT_SOCKET_VAD_CONFIG = {
     'sample_rate': 16000,  # WebRTC VAD requires 8000, 16000, 32000, or 48000 Hz
@@ -25,6 +52,7 @@ DEFAULT_SOCKET_VAD_CONFIG = {
     'use_rms_vad': True,
     'webrtc_weight': 0.7,  # Weight for WebRTC VAD result in ensemble
     'rms_weight': 0.3,  # Weight for RMS VAD result in ensemble
+    'webrtc_min_rms_level': 0.0018,  # Frames quieter than this (about -55 dBFS) skip WebRTC VAD as silence
     'session_timeout_ms': 300000,  # 5 minutes
     'buffer_size': 1024,  # Buffer size for audio processing
     'debug': False
@@ -32,13 +60,15 @@ DEFAULT_SOCKET_VAD_CONFIG = {
 
 @dataclass
 class AudioFrame:
-    """Represents a frame of audio data for processing."""
-    data: bytes
+    """Represents the analysis results of a processed audio frame."""
+    # Slots instead of a per-frame __dict__ (dataclass(slots=True) needs Python 3.10)
+    __slots__ = ('rms_level', 'timestamp', 'is_speech_rms', 'is_speech_webrtc', 'is_speech_ensemble')
+    
     rms_level: float
     timestamp: int
-    is_speech_rms: bool = False
-    is_speech_webrtc: bool = False
-    is_speech_ensemble: bool = False
+    is_speech_rms: bool
+    is_speech_webrtc: bool
+    is_speech_ensemble: bool
 
 class UserSession:
     """Manages a single user's VAD session and state."""
@@ -52,7 +82,7 @@ class UserSession:
             config: Configuration options, will be merged with defaults
         """
         self.session_id = session_id
-        self.created_at = int(time.time() * 1000)
+        self.created_at = time.time_ns() // 1_000_000
         self.last_activity = self.created_at
         self.config = DEFAULT_SOCKET_VAD_CONFIG.copy()
         if config:
@@ -72,60 +102,109 @@ class UserSession:
         self.is_speaking = False
         self.speech_start_time = 0
         self.speech_end_time = 0
-        self.frames: List[AudioFrame] = []
         self.max_frames = 100  # Keep last 100 frames for analysis
+        self.frames: Deque[AudioFrame] = deque(maxlen=self.max_frames)  # Oldest frame drops off when full
         
         # Debug stats
         self.total_frames = 0
         self.speech_frames = 0
         
-        # Calculate frame size in bytes based on sample rate and frame duration
-        bytes_per_sample = 2  # 16-bit audio = 2 bytes per sample
-        self.frame_size = int(self.config['sample_rate'] * 
-                             (self.config['frame_duration_ms'] / 1000.0) * 
-                             bytes_per_sample)
+        self._update_frame_size()
+        self._sync_frame_config()
                              
         if self.config['debug']:
             print(f"[UserSession] Created new session {session_id}")
             print(f"[UserSession] Frame size: {self.frame_size} bytes")
     
+    def _update_frame_size(self) -> None:
+        """Calculate frame size in bytes based on sample rate and frame duration."""
+        bytes_per_sample = 2  # 16-bit audio = 2 bytes per sample
+        self.frame_size = int(self.config['sample_rate'] * 
+                             (self.config['frame_duration_ms'] / 1000.0) * 
+                             bytes_per_sample)
+    
+    def _sync_frame_config(self) -> None:
+        """Copy the config values read on every frame into attributes."""
+        self._use_webrtc_vad = self.config['use_webrtc_vad']
+        self._use_rms_vad = self.config['use_rms_vad']
+        self._webrtc_weight = self.config['webrtc_weight']
+        self._rms_weight = self.config['rms_weight']
+        self._webrtc_min_rms_level = self.config['webrtc_min_rms_level']
+        self._sample_rate = self.config['sample_rate']
+        
+        # Ensemble verdict for every (is_speech_rms, is_speech_webrtc) pair, indexed by rms * 2 + webrtc
+        self._ensemble_table = tuple(
+            self._combine_verdicts(bool(index & 2), bool(index & 1)) for index in range(4)
+        )
+        
+        # WebRTC VAD may be switched on after the session was created without it
+        if self._use_webrtc_vad and self.webrtc_vad is None:
+            self.webrtc_vad = webrtcvad.Vad(self.config['aggressiveness'])
+    
+    def _combine_verdicts(self, is_speech_rms: bool, is_speech_webrtc: bool) -> bool:
+        """Combine the RMS and WebRTC verdicts according to the enabled methods and weights."""
+        if self._use_webrtc_vad and self._use_rms_vad:
+            ensemble_score = (
+                (is_speech_webrtc * self._webrtc_weight) + 
+                (is_speech_rms * self._rms_weight)
+            )
+            return ensemble_score > 0.5
+        elif self._use_webrtc_vad:
+            return is_speech_webrtc
+        else:
+            return is_speech_rms
+    
     def is_expired(self) -> bool:
         """Check if this session has expired based on inactivity."""
-        now = int(time.time() * 1000)
+        now = time.time_ns() // 1_000_000
         return (now - self.last_activity) > self.config['session_timeout_ms']
     
-    def update_activity(self) -> None:
-        """Update the last activity timestamp."""
-        self.last_activity = int(time.time() * 1000)
+    def update_activity(self, now: Optional[int] = None) -> None:
+        """Update the last activity timestamp, optionally to an already-read time in ms."""
+        self.last_activity = time.time_ns() // 1_000_000 if now is None else now
     
-    def process_audio_chunk(self, audio_data: bytes) -> Dict[str, Any]:
+    def process_audio_chunk(self, audio_data: Union[str, bytes]) -> Dict[str, Any]:
         """
         Process an incoming audio chunk and determine VAD status.
         
         Args:
-            audio_data: Base64-encoded PCM audio data
+            audio_data: Raw PCM bytes (binary Socket.IO attachment) or base64-encoded PCM string
             
         Returns:
             Dictionary with VAD results
         """
-        self.update_activity()
-        timestamp = int(time.time() * 1000)
+        timestamp = time.time_ns() // 1_000_000
+        self.update_activity(timestamp)
         
-        # Decode base64 audio data
-        try:
-            decoded_audio = base64.b64decode(audio_data)
-        except Exception as e:
-            if self.config['debug']:
-                print(f"[UserSession] Error decoding audio: {e}")
-            return {"error": "Invalid audio data format"}
+        # Read the frame config once so the whole chunk is framed consistently
+        frame_size = self.frame_size
+        sample_rate = self._sample_rate
+        
+        # Binary attachments arrive as raw PCM; only text payloads need base64 decoding
+        if isinstance(audio_data, (bytes, bytearray)):
+            decoded_audio = audio_data
+        else:
+            try:
+                decoded_audio = base64.b64decode(audio_data)
+            except Exception as e:
+                if self.config['debug']:
+                    print(f"[UserSession] Error decoding audio: {e}")
+                return {"error": "Invalid audio data format"}
         
-        # Process the audio frame by frame
+        # Compute every whole frame's RMS level in one pass over the buffer
+        n_frames = len(decoded_audio) // frame_size
+        pcm_frames = np.frombuffer(
+            decoded_audio, dtype=np.int16, count=n_frames * frame_size // 2
+        ).reshape(n_frames, frame_size // 2)
+        rms_levels = frames_rms(pcm_frames)
+        
+        # Process the audio frame by frame, slicing zero-copy views of the decoded buffer
         results = []
-        for i in range(0, len(decoded_audio), self.frame_size):
-            if i + self.frame_size <= len(decoded_audio):
-                frame_data = decoded_audio[i:i+self.frame_size]
-                result = self._process_frame(frame_data, timestamp)
-                results.append(result)
+        audio_view = memoryview(decoded_audio)
+        for i in range(n_frames):
+            frame_data = audio_view[i * frame_size:(i + 1) * frame_size]
+            result = self._process_frame(frame_data, rms_levels[i], timestamp, frame_size, sample_rate)
+            results.append(result)
         
         # Determine overall speech state from the frame results
         if results:
@@ -163,52 +242,42 @@ class UserSession:
             "session_id": self.session_id
         }
     
-    def _process_frame(self, frame_data: bytes, timestamp: int) -> Dict[str, Any]:
+    def _process_frame(self, frame_data: memoryview, rms_level: float, timestamp: int,
+                       frame_size: int, sample_rate: int) -> Dict[str, Any]:
         """
         Process a single frame of audio.
         
         Args:
-            frame_data: PCM audio data for a single frame
+            frame_data: View of the PCM audio data for a single frame
+            rms_level: Normalized (0-1) RMS level of the frame
             timestamp: Current timestamp in milliseconds
+            frame_size: Frame size in bytes the chunk was split with
+            sample_rate: Sample rate of the chunk's audio
             
         Returns:
             Frame processing results
         """
         self.total_frames += 1
         
-        # Calculate RMS level for this frame
-        pcm_data = np.frombuffer(frame_data, dtype=np.int16)
-        rms_level = np.sqrt(np.mean(pcm_data.astype(np.float32) ** 2)) / 32768.0  # Normalize to 0-1
-        
         # Process with AudioAnalysisService (RMS-based)
         rms_result = self.audio_service.add_audio_sample(rms_level, timestamp)
         is_speech_rms = rms_result['is_speech']
         
-        # Process with WebRTC VAD if enabled
+        # Process with WebRTC VAD if enabled; a disabled detector is skipped entirely
         is_speech_webrtc = False
-        if self.webrtc_vad and len(frame_data) == self.frame_size:
+        if self._use_webrtc_vad and len(frame_data) == frame_size and \
+           rms_level >= self._webrtc_min_rms_level:
             try:
-                is_speech_webrtc = self.webrtc_vad.is_speech(frame_data, self.config['sample_rate'])
+                is_speech_webrtc = self.webrtc_vad.is_speech(frame_data, sample_rate)
             except Exception as e:
                 if self.config['debug']:
                     print(f"[UserSession] WebRTC VAD error: {e}")
         
-        # Combine results if using both methods
-        is_speech_ensemble = False
-        if self.config['use_webrtc_vad'] and self.config['use_rms_vad']:
-            ensemble_score = (
-                (is_speech_webrtc * self.config['webrtc_weight']) + 
-                (is_speech_rms * self.config['rms_weight'])
-            )
-            is_speech_ensemble = ensemble_score > 0.5
-        elif self.config['use_webrtc_vad']:
-            is_speech_ensemble = is_speech_webrtc
-        else:
-            is_speech_ensemble = is_speech_rms
+        # Combine results using the table precomputed from the session config
+        is_speech_ensemble = self._ensemble_table[is_speech_rms * 2 + is_speech_webrtc]
         
         # Store frame info for debugging
         frame = AudioFrame(
-            data=frame_data,
             rms_level=rms_level,
             timestamp=timestamp,
             is_speech_rms=is_speech_rms,
@@ -216,8 +285,6 @@ class UserSession:
             is_speech_ensemble=is_speech_ensemble
         )
         
-        if len(self.frames) >= self.max_frames:
-            self.frames.pop(0)  # Remove oldest frame
         self.frames.append(frame)
         
         if is_speech_ensemble:
@@ -249,14 +316,16 @@ class UserSession:
             # Update WebRTC VAD if aggressiveness changed
             if 'aggressiveness' in config and self.config['use_webrtc_vad']:
                 self.webrtc_vad = webrtcvad.Vad(self.config['aggressiveness'])
+            
+            # Clients may switch to 8 kHz audio to halve the bytes sent per frame
+            if 'sample_rate' in config or 'frame_duration_ms' in config:
+                self._update_frame_size()
+            self._sync_frame_config()
                 
             # Apply audio service config changes
-            audio_service_config = {}
-            if 'initial_sensitivity_factor' in config:
-                audio_service_config['initial_sensitivity_factor'] = config['initial_sensitivity_factor']
-            if 'debug' in config:
-                audio_service_config['debug'] = config['debug']
-                
+            audio_service_config = {
+                key: config[key] for key in ('initial_sensitivity_factor', 'debug') if key in config
+            }
             if audio_service_config:
                 self.audio_service.update_config(audio_service_config)
                 
@@ -286,7 +355,7 @@ class UserSession:
                     "is_speech_ensemble": f.is_speech_ensemble,
                     "timestamp": f.timestamp
                 }
-                for f in self.frames[-5:] if self.frames
+                for f in islice(self.frames, max(0, len(self.frames) - 5), None)
             ],
             "audio_analysis": audio_debug
         }
@@ -299,6 +368,7 @@ class SocketVADService:
     def __init__(self, config: Optional[Dict[str, Any]] = None):
         """Initialize the Socket VAD Service."""
         self.sessions: Dict[str, UserSession] = {}
+        self._sessions_lock = threading.Lock()  # Guards creating and removing sessions; plain lookups are lock-free
         self.config = DEFAULT_SOCKET_VAD_CONFIG.copy()
         if config:
             self.config.update(config)
@@ -324,32 +394,34 @@ class SocketVADService:
         Returns:
             Tuple of (session_id, session)
         """
-        # Check if session exists and is valid
-        if session_id and session_id in self.sessions:
-            session = self.sessions[session_id]
-            if not session.is_expired():
+        # Look up, check and replace under the lock so two concurrent calls for
+        # the same ID cannot each create a session and overwrite the other's
+        with self._sessions_lock:
+            session = self.sessions.get(session_id) if session_id else None
+            if session is not None and not session.is_expired():
                 session.update_activity()
                 return session_id, session
+            
+            # Create new session
+            new_session_id = session_id or str(uuid.uuid4())
+            session = UserSession(new_session_id, self.config)
+            self.sessions[new_session_id] = session
         
-        # Create new session
-        new_session_id = session_id or str(uuid.uuid4())
-        self.sessions[new_session_id] = UserSession(new_session_id, self.config)
-        
-        return new_session_id, self.sessions[new_session_id]
+        return new_session_id, session
     
-    def process_audio(self, session_id: str, audio_data: bytes) -> Dict[str, Any]:
+    def process_audio(self, session_id: str, audio_data: Union[str, bytes]) -> Dict[str, Any]:
         """
         Process audio data for a specific session.
         
         Args:
             session_id: Session ID to process for
-            audio_data: Base64-encoded audio data
+            audio_data: Raw PCM bytes or base64-encoded PCM string
             
         Returns:
             Processing results
         """
-        if session_id in self.sessions:
-            session = self.sessions[session_id]
+        session = self.sessions.get(session_id)
+        if session is not None:
             return session.process_audio_chunk(audio_data)
         else:
             return {"error": f"Session {session_id} not found"}
@@ -357,16 +429,16 @@ class SocketVADService:
     def _cleanup_expired_sessions(self) -> None:
         """Remove expired sessions and restart timer."""
         try:
-            # Find expired sessions
-            now = time.time()
-            expired_sessions = [
-                sid for sid, session in self.sessions.items()
-                if session.is_expired()
-            ]
-            
-            # Remove expired sessions
-            for sid in expired_sessions:
-                del self.sessions[sid]
+            with self._sessions_lock:
+                # Find expired sessions
+                expired_sessions = [
+                    sid for sid, session in self.sessions.items()
+                    if session.is_expired()
+                ]
+                
+                # Remove expired sessions
+                for sid in expired_sessions:
+                    del self.sessions[sid]
                 
             if expired_sessions and self.config['debug']:
                 print(f"[SocketVADService] Cleaned up {len(expired_sessions)} expired sessions.")
@@ -387,10 +459,8 @@ class SocketVADService:
     
     def remove_session(self, session_id: str) -> bool:
         """Remove a session by ID."""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-            return True
-        return False
+        with self._sessions_lock:
+            return self.sessions.pop(session_id, None) is not None
 
 # Create a global instance for service-wide use
 socket_vad_service = SocketVADService() 
\ No newline at end of file
@@ -15,37 +15,39 @@ def test_rest_api(base_url):
     """Test the REST API endpoints."""
     print("Testing REST API...")
     
-    # Health check
-    try:
-        response = requests.get(f"{base_url}/api/health")
-        if response.status_code == 200:
-            print("✅ Health check successful")
-        else:
-            print(f"❌ Health check failed: {response.status_code}")
-    except Exception as e:
-        print(f"❌ Health check error: {e}")
-    
-    # Get mentors
-    try:
-        response = requests.get(f"{base_url}/api/mentors")
-        if response.status_code == 200:
-            mentors = response.json().get('mentors', [])
-            print(f"✅ Mentors API successful: {len(mentors)} mentors found")
-        else:
-            print(f"❌ Mentors API failed: {response.status_code}")
-    except Exception as e:
-        print(f"❌ Mentors API error: {e}")
-    
-    # Audio analysis threshold
-    try:
-        response = requests.get(f"{base_url}/api/audio-analysis/threshold")
-        if response.status_code == 200:
-            threshold = response.json().get('threshold', 0)
-            print(f"✅ Audio threshold API successful: threshold={threshold}")
-        else:
-            print(f"❌ Audio threshold API failed: {response.status_code}")
-    except Exception as e:
-        print(f"❌ Audio threshold API error: {e}")
+    # Share one keep-alive connection across the requests
+    with requests.Session() as session:
+        # Health check
+        try:
+            response = session.get(f"{base_url}/api/health")
+            if response.status_code == 200:
+                print("✅ Health check successful")
+            else:
+                print(f"❌ Health check failed: {response.status_code}")
+        except Exception as e:
+            print(f"❌ Health check error: {e}")
+    
+        # Get mentors
+        try:
+            response = session.get(f"{base_url}/api/mentors")
+            if response.status_code == 200:
+                mentors = response.json().get('mentors', [])
+                print(f"✅ Mentors API successful: {len(mentors)} mentors found")
+            else:
+                print(f"❌ Mentors API failed: {response.status_code}")
+        except Exception as e:
+            print(f"❌ Mentors API error: {e}")
+    
+        # Audio analysis threshold
+        try:
+            response = session.get(f"{base_url}/api/audio-analysis/threshold")
+            if response.status_code == 200:
+                threshold = response.json().get('threshold', 0)
+                print(f"✅ Audio threshold API successful: threshold={threshold}")
+            else:
+                print(f"❌ Audio threshold API failed: {response.status_code}")
+        except Exception as e:
+            print(f"❌ Audio threshold API error: {e}")
 
 def test_socketio(base_url):
     """Test the SocketIO functionality."""
@@ -100,6 +102,10 @@ def test_socketio(base_url):
     def vad_result(data):
         print(f"✅ VAD result received: is_speech={data.get('is_speech')}")
     
+    @sio.event
+    def vad_update_batch(data):
+        print(f"✅ VAD update batch received: {len(data)} updates")
+    
     @sio.event
     def recalibration_started(data):
         print(f"✅ Recalibration started: {data.get('session_id')}")